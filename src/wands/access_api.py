@@ -1,9 +1,146 @@
+from collections import OrderedDict
 from typing import Iterable
+import math
 
 import numpy as np
 import adios2
 import h5py
 
+from .adios import _adios
+
+# Initial size of the buffer an ADIOSServer receives axis names into
+MAX_AXIS_LEN = 1024
+# Separates the axis names requested together. HDF5 names cannot contain it
+AXIS_SEPARATOR = "\0"
+# Number of recently requested axis combinations ADIOSData keeps encoded
+NAME_CACHE_SIZE = 8
+# The axis and axis_check engines each use their own IO, on the Port of the
+# data link shifted by these offsets. Dataman also binds Port + 1 of each IO
+AXIS_PORT_OFFSET = 2
+AXIS_CHECK_PORT_OFFSET = 4
+# Port Dataman listens on when none is given, the base of the offsets above
+DATAMAN_DEFAULT_PORT = 50001
+# numpy dtype of each type name returned by adios2.Variable.Type()
+ADIOS_DTYPES = {
+    "char": np.byte,
+    "int8_t": np.int8,
+    "int16_t": np.int16,
+    "int32_t": np.int32,
+    "int64_t": np.int64,
+    "uint8_t": np.uint8,
+    "uint16_t": np.uint16,
+    "uint32_t": np.uint32,
+    "uint64_t": np.uint64,
+    "float": np.float32,
+    "double": np.float64,
+    "long double": np.longdouble,
+    "float complex": np.complex64,
+    "double complex": np.complex128,
+}
+
+
+def _declare_io(adios, name: str, engine: str):
+    """
+    Declare an IO on the shared ADIOS object, or fetch it if it already exists.
+
+    Parameters
+    ----------
+    adios : adios2.ADIOS
+        ADIOS object to declare the IO on.
+    name : str
+        Name of the IO.
+    engine : str
+        Engine the IO uses.
+
+    Returns
+    -------
+    adios2.IO
+    """
+    try:
+        io = adios.DeclareIO(name)
+    except ValueError:
+        io = adios.AtIO(name)
+    io.SetEngine(engine)
+    return io
+
+
+def _offset_port(parameters: dict, offset: int) -> dict:
+    """
+    Copy engine parameters with their Port, if any, shifted by offset.
+
+    Parameters
+    ----------
+    parameters : dict
+        Engine parameters.
+    offset : int
+        Amount to shift the Port by.
+
+    Returns
+    -------
+    dict
+    """
+    parameters = dict(parameters)
+    if "Port" in parameters:
+        parameters["Port"] = str(int(parameters["Port"]) + offset)
+    return parameters
+
+
+def _define_variable(io, name: str, data, shape) -> adios2.Variable:
+    """
+    Define a variable on first use and only update its selection afterwards.
+
+    Parameters
+    ----------
+    io : adios2.IO
+        IO to define the variable on.
+    name : str
+        Name of the variable.
+    data
+        Data that will be Put into the variable.
+    shape
+        Global shape of the data.
+
+    Returns
+    -------
+    adios2.Variable
+    """
+    shape = list(shape)
+    start = [0] * len(shape)
+
+    # the IO keeps variables across engines and instances, so it may already exist
+    variable = io.InquireVariable(name)
+    if not variable:
+        variable = io.DefineVariable(name, data, shape, start, shape, False)
+    else:
+        variable.SetShape(shape)
+        variable.SetSelection([start, shape])
+
+    return variable
+
+
+def _begin_step(reader) -> None:
+    """
+    Begin the next step of a reading engine.
+
+    Parameters
+    ----------
+    reader : adios2.Engine
+        Engine to begin the step on.
+
+    Returns
+    -------
+    None
+
+    Raises
+    ------
+    StopIteration
+        If the step could not be started, e.g. because the writer closed
+        the stream.
+    """
+    step_status = reader.BeginStep()
+    if step_status != adios2.StepStatus.OK:
+        raise StopIteration(f"next step failed to initiate {step_status!s}")
+
 
 class ADIOSData:
     """
@@ -15,6 +152,8 @@ class ADIOSData:
     _adios = None
     _parameters = None
     _io = None
+    _axis_io = None
+    _axis_check_io = None
     _link = None
     _engine = None
 
@@ -32,15 +171,51 @@ class ADIOSData:
             Parameters to pass to the engine for initialisation.
 
         """
-        self._adios = adios2.ADIOS()
+        self._adios = _adios()
         self._link = link
         self._engine = engine
 
-        self._io = self._adios.DeclareIO(self._link)
-        self._io.SetEngine(self._engine)
+        # one IO per engine pair so that each pair gets its own endpoint. The
+        # IO names carry the role so both ends of a link can share one ADIOS
+        # object, only the engine names passed to Open have to match
+        self._axis_io = _declare_io(
+            self._adios, "client/axis" + self._link, self._engine
+        )
+        self._axis_check_io = _declare_io(
+            self._adios, "client/axis_check" + self._link, self._engine
+        )
+        self._io = _declare_io(self._adios, "client/" + self._link, self._engine)
         if parameters:
             self._parameters = parameters
-            self.set_parameters(self._parameters)
+        # always called so every IO gets its own Port, see set_parameters
+        self.set_parameters(**parameters)
+
+        self._axis_writer = None
+        self._axis_check_reader = None
+        self._data_reader = None
+        # encoded axis names of the most recent requests, keyed by the joined
+        # names and least recently used first
+        self._name_cache = OrderedDict()
+
+    def _ensure_engines(self) -> None:
+        """
+        Open the engines to the ADIOSServer on first use and keep them open.
+
+        The engines are opened in the same order as ADIOSServer opens its
+        counterparts so that the rendezvous of each pair can complete.
+
+        Returns
+        -------
+        None
+        """
+        if self._axis_writer is not None:
+            return
+
+        self._axis_writer = self._axis_io.Open("axis" + self._link, adios2.Mode.Write)
+        self._axis_check_reader = self._axis_check_io.Open(
+            "axis_check" + self._link, adios2.Mode.Read
+        )
+        self._data_reader = self._io.Open(self._link, adios2.Mode.Read)
 
     def __getitem__(self, axis: str) -> Iterable:
         """
@@ -67,52 +242,125 @@ class ADIOSData:
         KeyError
             If axis is not found when indexed against the HDF5 source.
         """
-        # Send name of axis across
-        axis_writer = self._io.Open("axis" + self._link, adios2.Mode.Write)
-
-        axis_as_bytes = bytearray(axis, "utf-8")
-
-        sendbuffer = self._io.DefineVariable(
-            "axis",
-            axis_as_bytes,
-            shape := len(axis_as_bytes),
-            0,
-            shape,
-            adios2.ConstantDims,
-        )
-        axis_writer.BeginStep()
-        axis_writer.Put(sendbuffer, data)
-        axis_writer.EndStep()
-        axis_writer.Close()
+        return self.getmany([axis])[axis]
+
+    def getmany(self, axes: list[str]) -> dict:
+        """
+        Request several HDF5 axes from the specified link.
+
+        All axis names are sent in one step and the ADIOSServer answers
+        with one step holding every axis it found, so a batch costs a
+        single round trip however many axes it contains.
+
+        Parameters
+        ----------
+        axes : list[str]
+            Names to request from the known HDF5 file. See __getitem__.
 
-        axis_check_reader = self._io.Open("axis_check" + self._link, adios2.Mode.Read)
-        axis_check = self._io.InquireVariable("axis_check")
+        Returns
+        -------
+        dict
+            np.ndarray or similar of the requested data, keyed by axis.
 
-        axis_check_reader.BeginStep()
-        received_axis = np.zeros(1)
-        axis_check_reader.Get(axis_check, received_axis, adios2.Mode.Sync)
-        axis_check_reader.EndStep()
-        axis_check_reader.Close()
+        Raises
+        ------
+        KeyError
+            If any axis is not found as a dataset in the HDF5 source.
+            The responses for all other axes are still consumed first.
+        ValueError
+            If an axis name contains AXIS_SEPARATOR. Nothing is sent then.
+        TypeError
+            If an axis has an ADIOS type without a numpy dtype in ADIOS_DTYPES.
+            The step is still finished first.
+        """
+        # nothing to request, sending an empty name would desync the streams
+        if not axes:
+            return {}
+
+        self._ensure_engines()
+
+        # the server defines one variable per axis, so each may only appear once
+        axes = list(dict.fromkeys(axes))
+        # the server would split such a name and reply with more flags than expected
+        for axis in axes:
+            if AXIS_SEPARATOR in axis:
+                raise ValueError(f"Axis name {axis!r} contains the axis separator")
+
+        # Send the names of all axes across in one step
+        names = AXIS_SEPARATOR.join(axes)
+        axis_as_bytes = self._name_cache.get(names)
+        if axis_as_bytes is None:
+            axis_as_bytes = np.frombuffer(names.encode("utf-8"), dtype=np.uint8)
+            self._name_cache[names] = axis_as_bytes
+            if len(self._name_cache) > NAME_CACHE_SIZE:
+                self._name_cache.popitem(last=False)
+        else:
+            self._name_cache.move_to_end(names)
+        sendbuffer = _define_variable(
+            self._axis_io, "axis", axis_as_bytes, axis_as_bytes.shape
+        )
 
-        if not received_axis[0]:
-            raise KeyError("Axis not found in source file")
+        self._axis_writer.BeginStep()
+        self._axis_writer.Put(sendbuffer, axis_as_bytes, adios2.Mode.Deferred)
+        self._axis_writer.EndStep()
+
+        _begin_step(self._axis_check_reader)
+        axis_check = self._axis_check_io.InquireVariable("axis_check")
+        # one byte per axis, 1 if it was found
+        received_axis = np.empty(len(axes), dtype=np.uint8)
+        self._axis_check_reader.Get(axis_check, received_axis, adios2.Mode.Deferred)
+        self._axis_check_reader.EndStep()
+
+        found = [axis for axis, axis_found in zip(axes, received_axis) if axis_found]
+        missing = [axis for axis, axis_found in zip(axes, received_axis) if not axis_found]
+
+        # ADIOSServer only sends a data step if it found any of the axes.
+        # All Gets are deferred and performed together by EndStep
+        received = {}
+        unsupported = {}
+        if found:
+            _begin_step(self._data_reader)
+            for axis in found:
+                data_in = self._io.InquireVariable(axis)
+                dtype = ADIOS_DTYPES.get(data_in.Type())
+                if dtype is None:
+                    unsupported[axis] = data_in.Type()
+                    continue
+                # ADIOS overwrites the whole buffer, there is no need to zero it
+                received_data = np.empty(data_in.Shape(), dtype=dtype)
+                self._data_reader.Get(data_in, received_data, adios2.Mode.Deferred)
+                received[axis] = received_data
+            # always finish the step so the next request stays in sync
+            self._data_reader.EndStep()
+
+        if unsupported:
+            names = ", ".join(
+                f"{axis} ({adios_type})" for axis, adios_type in unsupported.items()
+            )
+            raise TypeError(f"Unsupported ADIOS type: {names}")
 
-        # Now get the data
-        data_reader = self._io.Open(self._link, adios2.Mode.Read)
+        if missing:
+            raise KeyError(f"Axis not found in source file: {', '.join(missing)}")
 
-        data_in = self._io.InquireVariable(axis)
-        receveived_data = np.zeros(data_in.Shape())
+        return received
 
-        while (status := data_reader.BeginStep()) == adios2.StepStatus.OK:
-            if data_in:
-                data_reader.Get(data_in, received_data, adios2.Mode.Sync)
-                data_reader.EndStep()
-            if status == adios2.StepStatus.EndOfStream:
-                break
+    def close(self) -> None:
+        """
+        Close the engines opened by this instance and drop their variables.
 
-        data_reader.Close()
+        Returns
+        -------
+        None
+        """
+        for engine in (self._axis_writer, self._axis_check_reader, self._data_reader):
+            if engine is not None:
+                engine.Close()
 
-        return received_data
+        self._axis_writer = None
+        self._axis_check_reader = None
+        self._data_reader = None
+        for io in (self._axis_io, self._axis_check_io, self._io):
+            io.RemoveAllVariables()
 
     def set_parameters(self, **parameters) -> None:
         """
@@ -121,12 +369,22 @@ class ADIOSData:
         Parameters
         ----------
         **parameters
-            Key-value pair parameters to set for the engine.
+            Key-value pair parameters to set for the engine. The axis and
+            axis_check engines get the Port shifted by AXIS_PORT_OFFSET and
+            AXIS_CHECK_PORT_OFFSET. Dataman without a Port starts from
+            DATAMAN_DEFAULT_PORT.
 
         Returns
         -------
         None
         """
+        if self._engine == "Dataman":
+            # the offsets need an explicit base, otherwise all IOs share the default
+            parameters = {"Port": str(DATAMAN_DEFAULT_PORT), **parameters}
+        self._axis_io.SetParameters(_offset_port(parameters, AXIS_PORT_OFFSET))
+        self._axis_check_io.SetParameters(
+            _offset_port(parameters, AXIS_CHECK_PORT_OFFSET)
+        )
         self._io.SetParameters(parameters)
 
 
@@ -137,9 +395,11 @@ class ADIOSServer:
 
     _adios = None
     _io = None
+    _axis_io = None
+    _axis_check_io = None
     _parameters = None
     _link = None
-    _axis = None
+    _axes = None
     _source = None
     _engine = None
     _axis_received = False
@@ -155,61 +415,133 @@ class ADIOSServer:
         engine : str
             Engine to send data through. Default : Dataman.
         **parameters
-            Parameters to pass to the engine for initialisation.
+            Parameters to pass to the engine for initialisation. With BP5,
+            DirectIO="true" keeps large writes out of the page cache where the
+            filesystem supports O_DIRECT (not e.g. tmpfs or some NFS mounts).
         """
-        self._adios = adios2.ADIOS()
+        self._adios = _adios()
         self._link = link
         self._engine = engine
-        self._io = adios.DeclareIO(self._link)
-        self._io.SetEngine(self._engine)
+
+        # one IO per engine pair so that each pair gets its own endpoint. The
+        # IO names carry the role so both ends of a link can share one ADIOS
+        # object, only the engine names passed to Open have to match
+        self._axis_io = _declare_io(
+            self._adios, "server/axis" + self._link, self._engine
+        )
+        self._axis_check_io = _declare_io(
+            self._adios, "server/axis_check" + self._link, self._engine
+        )
+        self._io = _declare_io(self._adios, "server/" + self._link, self._engine)
         if parameters:
             self._parameters = parameters
-            self.set_parameters(self._parameters)
+        # always called so every IO gets its own Port, see set_parameters
+        self.set_parameters(**parameters)
 
         self._source = source
+        # Keep the file open for the lifetime of the server so HDF5 metadata
+        # and the chunk cache are reused across requests
+        self._h5 = h5py.File(
+            self._source, "r", rdcc_nbytes=256 * 1024 * 1024, rdcc_nslots=100003
+        )
+        self._axis_buf = np.empty(MAX_AXIS_LEN, dtype=np.uint8)
+        self._memmaps = {}
 
-    def _receive_axis(self) -> None:
+        self._axis_reader = None
+        self._axis_check_writer = None
+        self._data_writer = None
+
+    def set_parameters(self, **parameters) -> None:
         """
-        Receive a name of an axis to send.
+        Set the parameters for the engine.
+
+        Parameters
+        ----------
+        **parameters
+            Key-value pair parameters to set for the engine. The axis and
+            axis_check engines get the Port shifted by AXIS_PORT_OFFSET and
+            AXIS_CHECK_PORT_OFFSET. Dataman without a Port starts from
+            DATAMAN_DEFAULT_PORT.
 
         Returns
         -------
         None
         """
-        axis_reader = self._io.Open("axis" + self._link, adios2.Mode.Read)
-        axis = self._io.InquireVariable("axis")
+        if self._engine == "Dataman":
+            # the offsets need an explicit base, otherwise all IOs share the default
+            parameters = {"Port": str(DATAMAN_DEFAULT_PORT), **parameters}
+        self._axis_io.SetParameters(_offset_port(parameters, AXIS_PORT_OFFSET))
+        self._axis_check_io.SetParameters(
+            _offset_port(parameters, AXIS_CHECK_PORT_OFFSET)
+        )
+        self._io.SetParameters(parameters)
 
-        axis_reader.BeginStep()
-        received_axis = np.zeros(axis.Shape())
-        axis_reader.Get(axis, received_axis, adios2.Mode.Sync)
-        axis_reader.EndStep()
-        axis_reader.Close()
+    def _ensure_engines(self) -> None:
+        """
+        Open the engines to the ADIOSData client on first use and keep them open.
+
+        Returns
+        -------
+        None
+        """
+        if self._axis_reader is not None:
+            return
 
-        try:
-            self._axis = bytes(list(received_axis)).decode("utf-8")
-            with h5py.File(self._source, "r") as hf5ile:
-                _ = h5file[self._axis]
+        self._axis_reader = self._axis_io.Open("axis" + self._link, adios2.Mode.Read)
+        self._axis_check_writer = self._axis_check_io.Open(
+            "axis_check" + self._link, adios2.Mode.Write
+        )
+        self._data_writer = self._io.Open(self._link, adios2.Mode.Write)
 
-            self._axis_received = True
+    def _receive_axis(self) -> None:
+        """
+        Receive the names of the axes to send.
 
-        except KeyError:
-            self._axis_received = False
-            self._axis = None
+        Replies with one flag per name telling whether it was found in the
+        source.
 
-        axis_check_writer = self._io.Open("axis_check" + self._link, adios2.Mode.Write)
+        Returns
+        -------
+        None
 
-        sendbuffer = self._io.DefineVariable(
-            "axis_check", (int(self._axis_received)), (1,), 0, (1,), adios2.ConstantDims
+        Raises
+        ------
+        StopIteration
+            If no further request can be read, e.g. because the client closed
+            the stream.
+        """
+        self._ensure_engines()
+
+        _begin_step(self._axis_reader)
+        axis = self._axis_io.InquireVariable("axis")
+        axis_len = axis.Shape()[0]
+        if axis_len > len(self._axis_buf):
+            self._axis_buf = np.empty(axis_len, dtype=np.uint8)
+        received_axis = self._axis_buf[:axis_len]
+        self._axis_reader.Get(axis, received_axis, adios2.Mode.Sync)
+        self._axis_reader.EndStep()
+
+        received_axes = received_axis.tobytes().decode("utf-8").split(AXIS_SEPARATOR)
+        # groups are in the file too, but only datasets can be sent
+        axis_found = [
+            isinstance(self._h5.get(axis), h5py.Dataset) for axis in received_axes
+        ]
+
+        self._axes = [axis for axis, found in zip(received_axes, axis_found) if found]
+        self._axis_received = bool(self._axes)
+
+        axis_check = np.array(axis_found, dtype=np.uint8)
+        sendbuffer = _define_variable(
+            self._axis_check_io, "axis_check", axis_check, axis_check.shape
         )
 
-        axis_check_writer.BeginStep()
-        axis_check_writer.Put(sendbuffer, int(self._axis_received))
-        axis_check_writer.EndStep()
-        axis_check_writer.Close()
+        self._axis_check_writer.BeginStep()
+        self._axis_check_writer.Put(sendbuffer, axis_check)
+        self._axis_check_writer.EndStep()
 
     def _send_data(self, steps: int = 1) -> None:
         """
-        Send requested data
+        Send the requested axes together in a single step
 
         Parameters
         ----------
@@ -225,32 +557,140 @@ class ADIOSServer:
         KeyError
             If axis is not found when indexed against the HDF5 source.
         """
-        data_writer = self._io.Open(self._link, adios2.Mode.Write)
+        # BP5 already avoids the copy for deferred Puts, everywhere else a
+        # Sync Put writes the buffer out immediately
+        put_mode = adios2.Mode.Deferred if self._engine == "BP5" else adios2.Mode.Sync
+        # deferred Puts need their buffers alive until EndStep
+        pending = []
+
+        self._data_writer.BeginStep()
+        for axis in self._axes:
+            dataset = self._h5[axis]
+            if dataset.chunks is None:
+                data = self._memmap(axis, dataset)
+                if data is None:
+                    # Read once into a contiguous array so ADIOS can Put
+                    # straight from application memory
+                    data = np.ascontiguousarray(dataset[...])
+                sendbuffer = _define_variable(self._io, axis, data, data.shape)
+                self._data_writer.Put(sendbuffer, data, put_mode)
+                pending.append(data)
+            else:
+                self._send_chunks(axis, dataset)
+        self._data_writer.EndStep()
+
+        self._axes = None
+        self._axis_received = False
+
+    def _memmap(self, axis: str, dataset: h5py.Dataset):
+        """
+        Map a contiguous dataset straight from the source file.
 
-        with h5py.File(self._source, "r") as h5file:
-            data = h5file[axis]
-            sendbuffer = self._io.DefineVariable(
-                self._axis, data, shape := data.shape, 0, shape, adios2.ConstantDims
+        Parameters
+        ----------
+        axis : str
+            Name of the dataset in the source.
+        dataset : h5py.Dataset
+            Dataset to map.
+
+        Returns
+        -------
+        np.memmap or None
+            Read only view of the dataset, or None if its storage cannot be
+            mapped (chunked, filtered, external, not allocated or not in
+            native byte order) and it has to be read through h5py.
+        """
+        if axis in self._memmaps:
+            return self._memmaps[axis]
+
+        mapped = None
+        offset = dataset.id.get_offset()
+        if (
+            dataset.chunks is None
+            and dataset.compression is None
+            and dataset.external is None
+            and dataset.dtype.isnative
+            and offset is not None
+        ):
+            mapped = np.memmap(
+                self._source,
+                mode="r",
+                dtype=dataset.dtype,
+                offset=offset,
+                shape=dataset.shape,
             )
 
-            data_writer.BeginStep()
-            data_writer.Put(sendbuffer, h5file[axis])
-            data_writer.EndStep()
+        self._memmaps[axis] = mapped
+        return mapped
 
-        data_writer.Close()
+    def _send_chunks(self, axis: str, dataset: h5py.Dataset) -> None:
+        """
+        Put a chunked dataset one HDF5 chunk at a time.
 
-        self._axis = None
-        self._axis_received = False
+        Each chunk is read into the same buffer and written as its own block
+        of the variable, so the full dataset is never held in memory.
+
+        Parameters
+        ----------
+        axis : str
+            Name of the variable to send the dataset as.
+        dataset : h5py.Dataset
+            Chunked dataset to send.
+
+        Returns
+        -------
+        None
+        """
+        # A flat buffer keeps every reshaped view contiguous, including the
+        # smaller chunks at the edges of the dataset
+        block_buf = np.empty(math.prod(dataset.chunks), dtype=dataset.dtype)
+        sendbuffer = _define_variable(self._io, axis, block_buf, dataset.shape)
+
+        for selection in dataset.iter_chunks():
+            start = [dim.start for dim in selection]
+            count = [dim.stop - dim.start for dim in selection]
+
+            block = block_buf[: math.prod(count)].reshape(count)
+            dataset.read_direct(block, source_sel=selection)
+
+            sendbuffer.SetSelection([start, count])
+            # The buffer is reused for the next chunk so it must be written now
+            self._data_writer.Put(sendbuffer, block, adios2.Mode.Sync)
 
     def chill(self) -> None:
         """
-        Chill out and wait for someone to ask for data.
+        Chill out and wait for someone to ask for data, until the client
+        closes its end of the stream.
 
         Returns
         -------
         None
         """
         while True:
-            self._receive_axis()
+            try:
+                self._receive_axis()
+            except StopIteration:
+                return
             if self._axis_received:
                 self._send_data()
+
+    def close(self) -> None:
+        """
+        Close the engines and the HDF5 source opened by this instance and
+        drop the engines' variables.
+
+        Returns
+        -------
+        None
+        """
+        for engine in (self._axis_reader, self._axis_check_writer, self._data_writer):
+            if engine is not None:
+                engine.Close()
+
+        self._axis_reader = None
+        self._axis_check_writer = None
+        self._data_writer = None
+        for io in (self._axis_io, self._axis_check_io, self._io):
+            io.RemoveAllVariables()
+        self._memmaps = {}
+        self._h5.close()
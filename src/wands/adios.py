@@ -12,6 +12,15 @@ import adios2
 adios_io = None
 
 
+def _adios():
+    """
+    Return the ADIOS object of this application, creating it on first use.
+    """
+    global adios_io
+    if adios_io is None:
+        adios_io = adios2.ADIOS()
+    return adios_io
+
 class AdiosObject:
     """
     Create an Adios object
@@ -21,17 +30,13 @@ class AdiosObject:
     """
 
     def __init__(self, link: str, engine: str, parameters=None):
-        # only call once
-        global adios_io
-        if adios_io is None:
-            adios_io = adios2.ADIOS()
         self._link = link
         self._engine = engine
         try:
-            self._io = adios_io.DeclareIO(self._link)
+            self._io = _adios().DeclareIO(self._link)
         except ValueError as ex:
             try:
-                self._io = adios_io.AtIO(self._link)
+                self._io = _adios().AtIO(self._link)
             except:
                 raise ValueError("Declare IO failed") from ex
         try:
@@ -1,9 +1,12 @@
 import adios2
+import logging
 import re
 import numpy as np
 from pathlib import Path
 from .adios import AdiosObject
 
+logger = logging.getLogger(__name__)
+
 
 class DataCache:
     """
@@ -26,6 +29,11 @@ class DataCache:
         if not self._path.exists():
             self._path.mkdir(parents=True, exist_ok=True)
 
+        # set of (bp file path, signal) pairs known to be in the cache.
+        # Files written before this object existed are added by prime_index()
+        self._index = set()
+        self._index_primed = False
+
     def __str__(self):
         """
         Returns: string to print Datacache object
@@ -38,6 +46,39 @@ class DataCache:
     def get_IOParams(self):
         return self._adob.__str__()
 
+    def prime_index(self):
+        """
+        Scan the cache folder once and record which signals every file holds,
+        so check_availability does not have to open files on each request.
+        """
+        index_adob = AdiosObject(
+            f"{self._adob.get_link()}_index", self._adob.get_engine()
+        )
+        index_io = index_adob.get_IO()
+        for bpfilename_path in self._path.glob("*.bp"):
+            # an unreadable or partially written file is left out of the index,
+            # its signals are then requested remotely
+            reader = None
+            try:
+                reader = index_io.Open(f"{bpfilename_path!s}", adios2.Mode.Read)
+                if reader:
+                    self._index.update(
+                        (f"{bpfilename_path!s}", signal)
+                        for signal in index_io.AvailableVariables()
+                    )
+            except (RuntimeError, ValueError) as ex:
+                logger.warning(
+                    "Skipping unreadable cache file %s: %s", bpfilename_path, ex
+                )
+            finally:
+                # do not leak the engine on the shared index IO
+                if reader:
+                    reader.Close()
+            # variables are kept in the IO, do not let them leak into the next file
+            index_io.RemoveAllVariables()
+        index_adob.close()
+        self._index_primed = True
+
     # def path_str(self):
     #         return f"{self._path!s}"
 
@@ -64,6 +105,8 @@ class DataCache:
         # print(bpfilename_path)
         writer = self._adob.get_IO().Open(f"{bpfilename_path!s}", adios2.Mode.Append)
 
+        # names actually written, skipped variables must not be indexed
+        written = []
         writer.BeginStep()
         for var_name, data in data_dict.items():
             # Test if the variable already exists
@@ -82,6 +125,7 @@ class DataCache:
             )
             # writer.Put(sendbuf, data_dict[var_name], adios2.Mode.Deferred)
             writer.Put(sendbuffer, data, adios2.Mode.Sync)
+            written.append(var_name)
             # raise ValueError("Variable definition failed")
 
         ## option if we want to write updates to the variables in steps. currently not planned
@@ -104,6 +148,8 @@ class DataCache:
         writer.EndStep()
         writer.Close()
 
+        self._index.update((f"{bpfilename_path!s}", var_name) for var_name in written)
+
     def check_availability(self, filename: str, data_list: list):
         """
         Check if data is available in data cache. Return the local data if available and a list with signals that need to be requested remotely
@@ -115,30 +161,19 @@ class DataCache:
 
         """
 
+        if not self._index_primed:
+            self.prime_index()
+
         bpfilename_path = self._path / re.sub("\.\w+$", ".bp", filename)
 
-        local_list = []
-        remote_list = []
-        # print(f"trying to open {bpfilename_path}")
-        if bpfilename_path.exists():
-            reader = self._adob.get_IO().Open(f"{bpfilename_path!s}", adios2.Mode.Read)
-            if reader:
-                # returns a Dict[str,Dict[str,str]] e.g. variable['signal'] = {'Shape':'200','Type':'double'}
-                variables = self._adob.get_IO().AvailableVariables()
-                for signal in data_list:
-                    if signal in variables:
-                        local_list.append(signal)
-                    else:
-                        remote_list.append(signal)
-            else:
-                # This should never happen since we checked before that the file exists
-                print(
-                    f"[WARNING] Even though the {bpfilename_path!s} exists WANDS was unable to open it. Requesting all datasets remotely"
-                )
-                remote_list = data_list
-            reader.Close()
-        else:
-            remote_list = data_list
+        if not bpfilename_path.exists():
+            return (data_list, [])
+
+        key = f"{bpfilename_path!s}"
+        local = {(key, signal) for signal in data_list} & self._index
+        # keep the order of the request
+        local_list = [signal for signal in data_list if (key, signal) in local]
+        remote_list = [signal for signal in data_list if (key, signal) not in local]
 
         return (remote_list, local_list)
 
@@ -155,7 +190,9 @@ class DataCache:
                 if reader:
                     # TODO at the moment only the first step is written and read
 
-                    while True:
+                    # stop reading steps once every signal has been found
+                    remaining = set(local_list)
+                    while remaining:
                         stepStatus = reader.BeginStep()
                         # print(stepStatus)
                         if stepStatus == adios2.StepStatus.OK:
@@ -172,6 +209,7 @@ class DataCache:
                                         )
                                         reader.Get(variable, data, adios2.Mode.Deferred)
                                         local_dict[signal] = data
+                                        remaining.discard(signal)
                         elif stepStatus == adios2.StepStatus.EndOfStream:
                             break
                         else:
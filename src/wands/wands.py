@@ -1,10 +1,28 @@
+import logging
+from functools import reduce
+from time import time
+
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
 
 # from pathlib import Path
 from .wan import WandsWAN
 from .data_cache import DataCache
 import json
 
+try:
+    import orjson
+
+    HAVE_ORJSON = True
+except ImportError:
+    HAVE_ORJSON = False
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+logger = logging.getLogger(__name__)
+
 
 class Wands:
     """
@@ -31,11 +49,23 @@ class Wands:
         }
 
         self._webaddress = webaddress
+        # orjson is faster and releases the GIL while encoding
+        self._json_dumps = orjson.dumps if HAVE_ORJSON else json.dumps
+        # reuse one keep-alive connection to the server across requests
+        self._session = requests.Session()
+        self._session.headers.update({"Connection": "keep-alive"})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=16, max_retries=3)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
         self.dataCache = DataCache(data_cache_path)
+        self.dataCache.prime_index()
 
     def cache_location(self):
         return f"{self.dataCache!s}"
 
+    def close(self):
+        self._session.close()
+
 
     def request_dict(self, filename: str, data_request) -> dict:
         """
@@ -63,9 +93,12 @@ class Wands:
                 "signals": data_request,
             }
             #print(json.dumps(data))
-            response = requests.post(self._webaddress, json=data)
-            print("response status code",response.status_code)
-            print("json response",response.json())
+            response = self._session.post(
+                self._webaddress, data=self._json_dumps(data), headers=JSON_HEADERS
+            )
+            logger.debug("response status code %s", response.status_code)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("json response %s", response.json())
             wandsWAN_obj = WandsWAN(parameters=self._Adiosparams)
 
             data_from_remote = wandsWAN_obj.receive(data_request)
@@ -76,15 +109,32 @@ class Wands:
         # only for performance measurement if remote_list:
         # only for performance measurement       print(f"t_getremote = {timeremote-timedatalocal}\n t_toDB = {timewrite-timeremote}")
         return data_from_remote 
+
+    def _post_request(self, filename: str, remote_list: list):
+        """
+        Ask the server to send the signals in remote_list. Makes no ADIOS calls,
+        so it is safe to run alongside ADIOS work on another thread.
+        """
+        data = {
+            "uri": filename,
+            "signals": remote_list,
+        }
+        response = self._session.post(
+            self._webaddress, data=self._json_dumps(data), headers=JSON_HEADERS
+        )
+        logger.debug("response status code %s", response.status_code)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("json response %s", response.json())
+        return response
+
     def request(self, filename: str, data_request) -> dict:
         """
         Request the needed data. This function will check if the data is available locally
         and otherwise request the data remotely.
         """
-        # only for performance measurement from time import time
-        #
-        # remove locally available datasets from list
-        # only for performance measurement print(f"request: type datalist: {type(data_list)}")
+        # timings are only taken when they will be logged
+        timing = logger.isEnabledFor(logging.DEBUG)
+        logger.debug("request: type datalist: %s", type(data_request))
         #if data_request == list
         # data_list = data request -> keep old functionality
         if isinstance(data_request, list):
@@ -98,7 +148,8 @@ class Wands:
                 print("ERROR:NOT SUPPORTED REQUEST TYPE, LIST of strings or LIST of Dictionary with shape and offset!")
         
         data_from_remote = {}
-        # only for performance measurement timereq = time()
+        if timing:
+            timereq = time()
 
         # create lists to see which data is already local and which data
         # needs to be fetched remotely
@@ -106,31 +157,99 @@ class Wands:
             filename=filename, data_list=data_list
         )
 
-        # only for performance measurement timecheckav = time()
-        # load the data that was previously defined as local from the local cache
-        data_from_cache = self.dataCache.load_from_cache(
-            filename=filename, local_list=local_list
-        )
-        # only for performance measurement timedatalocal = time()
-        # print(f"Signals found locally: {local_list}")
-        # print(f"Signals to be requested remotely: {remote_list}")
-        # fetch data remotely
+        if timing:
+            timecheckav = time()
+        logger.debug("Signals found locally: %s", local_list)
+        logger.debug("Signals to be requested remotely: %s", remote_list)
         if remote_list:
-            data = {
-                "uri": filename,
-                "signals": remote_list,
-            }
-            response = requests.post(self._webaddress, json=data)
-            print(response.status_code)
-            print(response.json())
+            # load the local data while the server handles the HTTP request.
+            # Only the POST runs on the worker thread, all ADIOS calls stay on
+            # this one as the shared ADIOS object and its IOs are not thread safe
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                future_post = executor.submit(self._post_request, filename, remote_list)
+                data_from_cache = self.dataCache.load_from_cache(
+                    filename=filename, local_list=local_list
+                )
+                future_post.result()
             wandsWAN_obj = WandsWAN(parameters=self._Adiosparams)
-
             data_from_remote = wandsWAN_obj.receive(remote_list)
-            # only for performance measurement timeremote = time()
+            if timing:
+                timefetch = time()
             self.dataCache.write(filename=filename, data_dict=data_from_remote)
-            # only for performance measurement timewrite = time()
-        # only for performance measurement print(f"Timings:\n check av = {timecheckav-timereq}\n t_lfc = {timedatalocal-timecheckav}\n ")
-        # only for performance measurement if remote_list:
-        # only for performance measurement       print(f"t_getremote = {timeremote-timedatalocal}\n t_toDB = {timewrite-timeremote}")
-        return data_from_remote | data_from_cache
+            if timing:
+                timewrite = time()
+                logger.debug(
+                    "Timings: check av = %s t_fetch = %s t_toDB = %s",
+                    timecheckav - timereq,
+                    timefetch - timecheckav,
+                    timewrite - timefetch,
+                )
+        else:
+            data_from_cache = self.dataCache.load_from_cache(
+                filename=filename, local_list=local_list
+            )
+            if timing:
+                timedatalocal = time()
+                logger.debug(
+                    "Timings: check av = %s t_lfc = %s",
+                    timecheckav - timereq,
+                    timedatalocal - timecheckav,
+                )
+        return self._merge(data_from_remote, data_from_cache)
+
+    def request_stacked(self, filename: str, signals: list) -> tuple:
+        """
+        Request the signals like request() but return them packed as the rows
+        of one contiguous array, which is faster to work through than many
+        separately allocated arrays.
+
+        Each signal is flattened into its row. Rows of signals shorter than
+        the longest one are padded with zeros and the array has the common
+        dtype of all signals.
+
+        Returns
+        -------
+        (np.ndarray, dict)
+            The stacked signals and a dict mapping each signal to its row.
+        """
+        return self._stack(self.request(filename, signals), signals)
+
+    @staticmethod
+    def _stack(data_dict: dict, signals: list) -> tuple:
+        """
+        Copy the arrays of data_dict into the rows of one array, in the order of signals.
+        """
+        arrays = [np.ravel(data_dict[signal]) for signal in signals]
+        max_len = max((array.size for array in arrays), default=0)
+        # pairwise, as np.result_type takes at most 32 arguments on numpy 1.x
+        dtype = (
+            reduce(np.promote_types, (array.dtype for array in arrays))
+            if arrays
+            else np.float64
+        )
+
+        out = np.empty((len(arrays), max_len), dtype=dtype)
+        for row, array in zip(out, arrays):
+            row[: array.size] = array
+            row[array.size :] = 0
+
+        return out, {signal: i for i, signal in enumerate(signals)}
+
+    @staticmethod
+    def _merge(data_from_remote: dict, data_from_cache: dict) -> dict:
+        """
+        Merge the remote and cached data into whichever dict is larger instead
+        of allocating a new one. As with data_from_remote | data_from_cache the
+        cached data wins if a signal is in both.
+        """
+        if not data_from_cache:
+            return data_from_remote
+        if not data_from_remote:
+            return data_from_cache
+        if len(data_from_remote) >= len(data_from_cache):
+            data_from_remote.update(data_from_cache)
+            return data_from_remote
+        for signal, data in data_from_remote.items():
+            data_from_cache.setdefault(signal, data)
+        return data_from_cache
 
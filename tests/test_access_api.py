@@ -0,0 +1,107 @@
+"""
+Round trip tests of ADIOSData against ADIOSServer over Dataman
+"""
+from multiprocessing import Process, Pipe
+
+import h5py
+import numpy as np
+import pytest
+
+from wands.access_api import ADIOSData, ADIOSServer, _offset_port
+
+
+PARAMS = {
+    "IPAddress": "127.0.0.1",
+    "Port": "12320",
+    "Timeout": "6",
+    "TransportMode": "reliable",
+    "RendezvousReaderCount": "1",
+}
+
+
+def thread_server(source: str):
+    server = ADIOSServer(link="testAccess", source=source, **PARAMS)
+    server.chill()
+    server.close()
+
+
+def thread_client(name):
+    client = ADIOSData(link="testAccess", **PARAMS)
+    results = {}
+    results["empty"] = client.getmany([])
+    results["double"] = client["FP/double"]
+    results["many"] = client.getmany(["FP/double", "FP/chunked"])
+    try:
+        client.getmany(["FP/double", "FP/missing"])
+        results["missing"] = None
+    except KeyError as ex:
+        results["missing"] = str(ex)
+    try:
+        client["FP"]
+        results["group"] = None
+    except KeyError as ex:
+        results["group"] = str(ex)
+    try:
+        client.getmany(["FP/double\0FP/chunked"])
+        results["separator"] = None
+    except ValueError as ex:
+        results["separator"] = str(ex)
+    # the streams are still in sync after a missing axis
+    results["after_missing"] = client["FP/chunked"]
+    client.close()
+    name.send(results)
+
+
+@pytest.fixture(name="source")
+def fixture_source(tmp_path):
+    source = tmp_path / "test_access.h5"
+    with h5py.File(source, "w") as h5file:
+        h5file.create_dataset("FP/double", data=np.arange(1, 10, dtype=np.double))
+        h5file.create_dataset(
+            "FP/chunked",
+            data=np.arange(20, dtype=np.single).reshape(4, 5),
+            chunks=(3, 2),
+        )
+    return str(source)
+
+
+def test_round_trip(source):
+    master_proc, client_proc = Pipe()
+    s = Process(target=thread_server, args=[source])
+    c = Process(target=thread_client, args=[client_proc])
+    s.start()
+    c.start()
+    results = master_proc.recv()
+    c.join()
+    s.join()
+
+    double = np.arange(1, 10, dtype=np.double)
+    chunked = np.arange(20, dtype=np.single).reshape(4, 5)
+    assert results["empty"] == {}
+    assert np.array_equal(results["double"], double)
+    assert np.array_equal(results["many"]["FP/double"], double)
+    assert results["many"]["FP/chunked"].dtype == np.float32
+    assert np.array_equal(results["many"]["FP/chunked"], chunked)
+    assert "FP/missing" in results["missing"]
+    assert "FP" in results["group"]
+    assert results["separator"] is not None
+    assert np.array_equal(results["after_missing"], chunked)
+
+
+def test_both_ends_in_one_process(source):
+    client = ADIOSData(link="testSameProcess", **PARAMS)
+    server = ADIOSServer(link="testSameProcess", source=source, **PARAMS)
+    assert client._io is not server._io
+    assert client._axis_io is not server._axis_io
+    assert client._axis_check_io is not server._axis_check_io
+    client.close()
+    server.close()
+
+
+def test_offset_port():
+    assert _offset_port({"Port": "12320", "Timeout": "6"}, 2) == {
+        "Port": "12322",
+        "Timeout": "6",
+    }
+    assert _offset_port({}, 2) == {}
+
@@ -140,3 +140,59 @@ def test_datacache_load_from_cache():
 
     shutil.rmtree(cache_dir)
     obj.close()
+
+
+def test_datacache_prime_index():
+    current_dir = os.getcwd()
+    cache_dir = current_dir + "/tests/test_cache"
+    writer_obj = DataCache(cache_dir)
+    testdict = {}
+    testdict["testdata"] = np.random.rand(3, 4)
+    writer_obj.write("testfile.h5", testdict)
+    writer_obj.close()
+
+    obj = DataCache(cache_dir)
+    obj.prime_index()
+    requestlist = ["testdata", "testdata1"]
+    [remotelist, locallist] = obj.check_availability("testfile.h5", requestlist)
+    assert locallist == ["testdata"]
+    assert remotelist == ["testdata1"]
+
+    shutil.rmtree(cache_dir)
+    obj.close()
+
+
+def test_datacache_prime_index_skips_unreadable():
+    current_dir = os.getcwd()
+    cache_dir = current_dir + "/tests/test_cache"
+    Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    (Path(cache_dir) / "broken.bp").write_text("not a bp file")
+
+    obj = DataCache(cache_dir)
+    obj.prime_index()
+    [remotelist, locallist] = obj.check_availability("broken.h5", ["testdata"])
+    assert remotelist == ["testdata"]
+    assert len(locallist) == 0
+
+    shutil.rmtree(cache_dir)
+    obj.close()
+
+
+def test_datacache_index_skipped_variable():
+    current_dir = os.getcwd()
+    cache_dir = current_dir + "/tests/test_cache"
+    obj = DataCache(cache_dir)
+    obj.write("testfile.h5", {"testdata": np.random.rand(3, 4)})
+    # testdata is already defined on the IO, so write() skips it for otherfile
+    obj.write(
+        "otherfile.h5",
+        {"testdata": np.random.rand(3, 4), "otherdata": np.random.rand(2)},
+    )
+    requestlist = ["testdata", "otherdata"]
+    [remotelist, locallist] = obj.check_availability("otherfile.h5", requestlist)
+    assert locallist == ["otherdata"]
+    assert remotelist == ["testdata"]
+
+    shutil.rmtree(cache_dir)
+    obj.close()
+
@@ -20,6 +20,47 @@ def test_init():
     assert wo.cache_location() == cache_dir
 
 
+def test_merge():
+    remote = {"a": np.ones(3), "b": np.ones(3)}
+    cache = {"c": np.zeros(3)}
+    merged = Wands._merge(remote, cache)
+    assert merged is remote
+    assert list(merged) == ["a", "b", "c"]
+    assert Wands._merge({}, cache) is cache
+    assert Wands._merge(cache, {}) is cache
+
+    remote = {"a": np.ones(3)}
+    cache = {"a": np.zeros(3), "c": np.zeros(3)}
+    merged = Wands._merge(remote, cache)
+    assert merged is cache
+    assert np.array_equal(merged["a"], np.zeros(3))
+
+
+def test_stack():
+    data_dict = {
+        "a": np.arange(4, dtype=np.float32),
+        "b": np.ones((2, 3), dtype=np.float64),
+    }
+    out, index = Wands._stack(data_dict, ["b", "a"])
+    assert out.shape == (2, 6)
+    assert out.dtype == np.float64
+    assert index == {"b": 0, "a": 1}
+    assert np.array_equal(out[index["b"]], np.ones(6))
+    assert np.array_equal(out[index["a"]], [0, 1, 2, 3, 0, 0])
+
+
+def test_stack_many_signals():
+    signals = [f"signal{i}" for i in range(100)]
+    data_dict = {
+        signal: np.full(i + 1, i, dtype=np.int32) for i, signal in enumerate(signals)
+    }
+    data_dict["signal99"] = data_dict["signal99"].astype(np.float64)
+    out, index = Wands._stack(data_dict, signals)
+    assert out.shape == (100, 100)
+    assert out.dtype == np.float64
+    assert np.array_equal(out[index["signal3"]], [3, 3, 3, 3] + [0] * 96)
+
+
 @pytest.fixture(name="server_srcdir")
 def fixture_server_srcdir():
     return Path(__file__).parent.parent / "server"